@@ -5,11 +5,12 @@ Using joblib for better version compatibility
 Run with: streamlit run app_compatible.py
 """
 import streamlit as st
-import pandas as pd
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-import joblib  # Use joblib instead of pickle for better compatibility
+import logging
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
 
 # Set up page
 st.set_page_config(
@@ -20,45 +21,184 @@ st.set_page_config(
 )
 
 # Constants
-T3_IMPORTANT_FEATURES = [
+# Feature order matches the order the preprocessors were fit on
+T3_IMPORTANT_FEATURES = (
     'LOS', 'BMI_Current', 'WOMACP_5', 'WeightCurrent', 'ICOAPC_3',
     'ICOAPC_1', 'AgePreOp', 'WOMACP_3', 'WalkPain', 'MobilityAidWalker',
     'Pre-Op Pain', 'HeightCurrent', 'ResultsRelief'
-]
+)
 
-T5_IMPORTANT_FEATURES = [
+T5_IMPORTANT_FEATURES = (
     'AgePreOp', 'BMI_Current', 'WeightCurrent', 'HeightCurrent', 'LOS',
     'WOMACP_5', 'ResultsRelief', 'ICOAPC_3', 'Pre-Op Pain', 'WalkPain',
     'Approach', 'HeadSize'
-]
+)
+
+# Sets of the same features, for fast membership checks
+T3_REQUIRED = frozenset(T3_IMPORTANT_FEATURES)
+T5_REQUIRED = frozenset(T5_IMPORTANT_FEATURES)
+
+IMPORTANT_FEATURES = {'T3': T3_IMPORTANT_FEATURES, 'T5': T5_IMPORTANT_FEATURES}
+
+# Accepted timepoint spellings -> (timepoint, ordered features, feature set)
+_DISPATCH = {
+    'T3': ('T3', T3_IMPORTANT_FEATURES, T3_REQUIRED),
+    't3': ('T3', T3_IMPORTANT_FEATURES, T3_REQUIRED),
+    'T5': ('T5', T5_IMPORTANT_FEATURES, T5_REQUIRED),
+    't5': ('T5', T5_IMPORTANT_FEATURES, T5_REQUIRED),
+}
 
 MODELS_DIR = 'streamlit_models'  # Change to the new directory name
 
+# Combined file for each timepoint, loaded in a single joblib call. It holds a
+# (preprocessor, model) tuple, in that order, and is written by combine_model_files.py
+_PIPELINE_PATHS = {tp: os.path.join(MODELS_DIR, f'{tp.lower()}_pipeline.joblib') for tp in ('T3', 'T5')}
+
+# Pipelines exported by convert_models_onnx.py, used instead of sklearn when onnxruntime is installed
+_ONNX_PATHS = {tp: os.path.join(MODELS_DIR, f'{tp.lower()}_pipeline.onnx') for tp in ('T3', 'T5')}
+
+# (model path, preprocessor path) for each timepoint, used when there is no combined file
+_MODEL_PATHS = {
+    tp: (
+        os.path.join(MODELS_DIR, f'{tp.lower()}_model.joblib'),
+        os.path.join(MODELS_DIR, f'{tp.lower()}_preprocessor.joblib')
+    )
+    for tp in ('T3', 'T5')
+}
+
+# Input widget for each feature as (streamlit widget name, widget kwargs).
+# Keying widgets by feature name lets Streamlit keep their values in session_state.
+_PAIN_0_4_SLIDER = ('slider', {'min_value': 0, 'max_value': 4, 'step': 1})  # WOMAC and ICOA scores
+_PAIN_0_10_SLIDER = ('slider', {'min_value': 0, 'max_value': 10, 'step': 1})  # Pain scores
+
+_YESNO = {0: "No", 1: "Yes"}
+
+WIDGET_SPECS = {
+    'MobilityAidWalker': ('selectbox', {'options': [0, 1], 'format_func': _YESNO.__getitem__}),
+    'Approach': ('selectbox', {'options': ["Posterior", "Anterior", "Lateral", "Other"]}),
+    'WOMACP_5': _PAIN_0_4_SLIDER,
+    'WOMACP_3': _PAIN_0_4_SLIDER,
+    'ICOAPC_3': _PAIN_0_4_SLIDER,
+    'ICOAPC_1': _PAIN_0_4_SLIDER,
+    'ResultsRelief': ('slider', {'min_value': 1, 'max_value': 5, 'step': 1}),
+    'WalkPain': _PAIN_0_10_SLIDER,
+    'Pre-Op Pain': _PAIN_0_10_SLIDER,
+    # HeadSize is typically 28, 32, or 36 mm
+    'HeadSize': ('selectbox', {'options': ["28", "32", "36", "40", "Other"]}),
+}
+
+# Default numeric input for other fields
+DEFAULT_WIDGET_SPEC = ('number_input', {'value': 0.0, 'step': 0.1})
+
+# Demo-mode formulas: prediction = bias + coef . [patient_data[k] for k in keys]
+_DEMO_DEFAULTS = {'BMI_Current': 25, 'AgePreOp': 65, 'Pre-Op Pain': 5, 'WalkPain': 5}
+
+_T3_DEMO_KEYS = ('BMI_Current', 'AgePreOp', 'Pre-Op Pain', 'WalkPain')
+_T3_DEMO_COEF = np.array([0.01, 0.01, 0.2, -0.1])
+_T3_DEMO_BIAS = 2.0
+
+_T5_DEMO_KEYS = ('BMI_Current', 'AgePreOp', 'Pre-Op Pain')
+_T5_DEMO_COEF = np.array([0.008, 0.005, 0.15])
+_T5_DEMO_BIAS = 1.5
+
+# Prediction gauge, rendered as inline SVG instead of building a matplotlib figure per click.
+# Bar colors follow matplotlib's RdYlGn_r colormap (red is high pain), reproduced here by
+# interpolating its ColorBrewer anchor colors so matplotlib isn't needed at runtime.
+_RDYLGN_R_ANCHORS = np.array([
+    (0, 104, 55), (26, 152, 80), (102, 189, 99), (166, 217, 106), (217, 239, 139),
+    (255, 255, 191), (254, 224, 139), (253, 174, 97), (244, 109, 67), (215, 48, 39), (165, 0, 38)
+])
+
+def _sample_gauge_colors(n):
+    """Return n hex colors evenly spaced along the RdYlGn_r colormap"""
+    positions = np.linspace(0, 1, n)
+    anchor_positions = np.linspace(0, 1, len(_RDYLGN_R_ANCHORS))
+    rgb = np.column_stack([
+        np.interp(positions, anchor_positions, _RDYLGN_R_ANCHORS[:, c]) for c in range(3)
+    ]).round().astype(int)
+    return ['#%02x%02x%02x' % tuple(c) for c in rgb]
+
+# Color lookup table at the 0.1 resolution the prediction is displayed with (0.0-8.0)
+_GAUGE_COLORS = _sample_gauge_colors(81)
+_GAUGE_X0 = 60  # left edge of the bar in SVG units
+_GAUGE_SCALE = 90  # SVG units per pain point
+_GAUGE_TICKS = ''.join(
+    f'<line x1="{_GAUGE_X0 + t * _GAUGE_SCALE}" y1="80" x2="{_GAUGE_X0 + t * _GAUGE_SCALE}" y2="86" stroke="black"/>'
+    f'<text x="{_GAUGE_X0 + t * _GAUGE_SCALE}" y="102" text-anchor="middle" font-size="14">{t}</text>'
+    for t in (0, 2, 4, 6, 8)
+)
+_GAUGE_SVG = (
+    '<svg viewBox="0 0 840 130" width="100%" xmlns="http://www.w3.org/2000/svg">'
+    # Background bar (grey), then the colored bar based on the prediction
+    f'<rect x="{_GAUGE_X0}" y="40" width="{8 * _GAUGE_SCALE}" height="40" fill="lightgrey" fill-opacity="0.3"/>'
+    f'<rect x="{_GAUGE_X0}" y="40" width="{{bar_width}}" height="40" fill="{{color}}"/>'
+    f'<line x1="{_GAUGE_X0}" y1="80" x2="{_GAUGE_X0 + 8 * _GAUGE_SCALE}" y2="80" stroke="black"/>'
+    + _GAUGE_TICKS +
+    f'<text x="{_GAUGE_X0}" y="120" text-anchor="middle" font-size="14">No Pain</text>'
+    f'<text x="{_GAUGE_X0 + 8 * _GAUGE_SCALE}" y="120" text-anchor="middle" font-size="14">Extreme Pain</text>'
+    # Marker and label for the prediction
+    '<circle cx="{marker_x}" cy="60" r="8" fill="black"/>'
+    '<text x="{marker_x}" y="32" text-anchor="middle" font-size="18" font-weight="bold">{value}</text>'
+    '</svg>'
+)
+
+# Descriptions for the features used in the models. Built once at import and
+# read-only, so callers can share it without copying.
+FEATURE_DESCRIPTIONS = MappingProxyType({
+    'LOS': 'Legth of stay (days)',
+    'BMI_Current': 'Body Mass Index',
+    'WOMACP_5': ' Pain Standing upright (0-4)',
+    'WeightCurrent': 'Current weight (kg)',
+    'ICOAPC_3': 'In the past week, how much has your constant hip pain affected your overall quality of life (0-4)',
+    'ICOAPC_1': 'In the past week, how intense has your constant hip pain been? (0-4)',
+    'AgePreOp': 'Age at pre-op (years)',
+    'WOMACP_3': 'Pain At night while in bed (0-4)',
+    'WalkPain': 'Pain while walking (0-10)',
+    'MobilityAidWalker': 'Uses walker as mobility aid',
+    'Pre-Op Pain': 'Pre-operation pain score (0-10)',
+    'HeightCurrent': 'Current height (cm)',
+    'ResultsRelief': 'Expected relief result (1-5)',
+    'Approach': 'Surgical approach (e.g., "Posterior", "Anterior")',
+    'HeadSize': 'Size of the femoral head implant (mm)'
+})
+
+# Widget label for each feature
+_LABELS = {
+    f: f"{f} ({FEATURE_DESCRIPTIONS.get(f, '')})"
+    for f in T3_REQUIRED | T5_REQUIRED
+}
+
 def get_feature_descriptions():
     """Return descriptions for the features used in the models"""
-    feature_descriptions = {
-        'LOS': 'Legth of stay (days)',
-        'BMI_Current': 'Body Mass Index',
-        'WOMACP_5': ' Pain Standing upright (0-4)',
-        'WeightCurrent': 'Current weight (kg)',
-        'ICOAPC_3': 'In the past week, how much has your constant hip pain affected your overall quality of life (0-4)',
-        'ICOAPC_1': 'In the past week, how intense has your constant hip pain been? (0-4)',
-        'AgePreOp': 'Age at pre-op (years)',
-        'WOMACP_3': 'Pain At night while in bed (0-4)',
-        'WalkPain': 'Pain while walking (0-10)',
-        'MobilityAidWalker': 'Uses walker as mobility aid',
-        'Pre-Op Pain': 'Pre-operation pain score (0-10)',
-        'HeightCurrent': 'Current height (cm)',
-        'ResultsRelief': 'Expected relief result (1-5)',
-        'Approach': 'Surgical approach (e.g., "Posterior", "Anterior")',
-        'HeadSize': 'Size of the femoral head implant (mm)'
-    }
-    return feature_descriptions
+    return FEATURE_DESCRIPTIONS
 
-def load_models(timepoint):
+def _derived_file_is_current(path, timepoint):
+    """
+    Check that a file derived from the split model/preprocessor files exists and is
+    at least as new as them, so a retrained model is never shadowed by a stale copy.
+    """
+    if not os.path.exists(path):
+        return False
+    
+    sources = [p for p in _MODEL_PATHS[timepoint] if os.path.exists(p)]
+    if sources and os.path.getmtime(path) < max(os.path.getmtime(p) for p in sources):
+        logger.warning("Ignoring '%s': it is older than the %s model files it was built from", path, timepoint)
+        return False
+    
+    return True
+
+def _load_models_from_disk(timepoint):
     """Load saved models and preprocessors using joblib"""
-    model_path = os.path.join(MODELS_DIR, f'{timepoint.lower()}_model.joblib')
-    preprocessor_path = os.path.join(MODELS_DIR, f'{timepoint.lower()}_preprocessor.joblib')
+    # Imported here so demo-mode sessions never pay for it
+    import joblib  # Use joblib instead of pickle for better compatibility
+    
+    # Prefer the combined file: one open and one unpickle instead of two
+    pipeline_path = _PIPELINE_PATHS[timepoint]
+    if _derived_file_is_current(pipeline_path, timepoint):
+        preprocessor, model = joblib.load(pipeline_path, mmap_mode='r')
+        return model, preprocessor
+    
+    model_path, preprocessor_path = _MODEL_PATHS[timepoint]
     
     if not (os.path.exists(model_path) and os.path.exists(preprocessor_path)):
         raise FileNotFoundError(
@@ -66,12 +206,84 @@ def load_models(timepoint):
             f"Please run 'train_models_compatible.py' first to create the models."
         )
     
-    # Load model and preprocessor using joblib
-    model = joblib.load(model_path)
-    preprocessor = joblib.load(preprocessor_path)
+    # Load model and preprocessor using joblib. The files are stored uncompressed, so
+    # mmap_mode='r' leaves the preprocessor's fitted arrays (imputer statistics, scaler
+    # mean and scale) memory-mapped from disk. The tree-based models gain little from
+    # this, because sklearn copies each tree's node arrays into its own buffers on load.
+    model = joblib.load(model_path, mmap_mode='r')
+    preprocessor = joblib.load(preprocessor_path, mmap_mode='r')
     
     return model, preprocessor
 
+@st.cache_resource
+def _load_models_once(timepoint):
+    """
+    Load a timepoint's models once per process, returning ((model, preprocessor), None)
+    or (None, error). st.cache_resource doesn't cache exceptions, so a failed load is
+    returned rather than raised; otherwise it would be retried on every rerun.
+    """
+    try:
+        return _load_models_from_disk(timepoint), None
+    except Exception as e:
+        return None, e
+
+def load_models(timepoint):
+    """Return the model and preprocessor, loading them on first use"""
+    models, error = _load_models_once(timepoint)
+    if error is not None:
+        raise error.with_traceback(None)
+    return models
+
+@st.cache_resource
+def _input_dtype(timepoint, _preprocessor):
+    """
+    Return the numpy record dtype of the preprocessor's input columns.
+    
+    Cached per timepoint for the life of the process; the leading underscore
+    keeps Streamlit from hashing the preprocessor.
+    """
+    from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder
+    
+    # Columns that go through an encoder are categorical, everything else is numeric
+    categorical = set()
+    for _, transformer, columns in _preprocessor.transformers_:
+        steps = [step for _, step in transformer.steps] if hasattr(transformer, 'steps') else [transformer]
+        if any(isinstance(step, (OneHotEncoder, OrdinalEncoder)) for step in steps):
+            categorical.update(columns)
+    
+    return np.dtype([
+        (name, object if name in categorical else np.float64)
+        for name in _preprocessor.feature_names_in_
+    ])
+
+@st.cache_resource
+def _load_onnx_session(timepoint):
+    """Return an ONNX Runtime session for the timepoint's exported pipeline, or None if unavailable"""
+    onnx_path = _ONNX_PATHS[timepoint]
+    if not _derived_file_is_current(onnx_path, timepoint):
+        return None
+    
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        return None
+    
+    # The app scores at most 11 rows at a time (one patient, or the Pre-Op Pain sweep);
+    # at that size a single thread avoids thread-pool overhead and gives the lowest latency
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = 1
+    try:
+        return ort.InferenceSession(onnx_path, sess_options, providers=['CPUExecutionProvider'])
+    except Exception:
+        # Corrupt file or opset/runtime mismatch: use the joblib models instead
+        logger.exception("Could not load '%s'; using the joblib models instead", onnx_path)
+        return None
+
+@st.cache_resource
+def _failed_onnx_timepoints():
+    """Timepoints whose ONNX session failed at predict time; shared for the life of the process"""
+    return set()
+
 def predict_with_model(patient_data, timepoint='T3'):
     """
     Predict pain score for a patient using the specified timepoint model.
@@ -88,74 +300,145 @@ def predict_with_model(patient_data, timepoint='T3'):
     float
         Predicted pain score
     """
-    # Ensure timepoint is uppercase
-    timepoint = timepoint.upper()
-    if timepoint not in ['T3', 'T5']:
-        raise ValueError("Timepoint must be 'T3' or 'T5'")
+    prediction = float(_predict_unclipped([patient_data], timepoint)[0])
     
-    # Load model and preprocessor
-    model, preprocessor = load_models(timepoint)
+    # Clip prediction to valid range [0, 8]; plain comparisons avoid np.clip's
+    # ufunc dispatch for a single scalar
+    return 0.0 if prediction < 0 else (8.0 if prediction > 8 else prediction)
+
+@st.cache_data(max_entries=256)
+def _cached_predict(items, timepoint):
+    """Memoized predict_with_model, keyed by the patient's sorted (feature, value) pairs"""
+    return predict_with_model(dict(items), timepoint)
+
+@st.cache_data(max_entries=256)
+def _cached_pre_op_pain_sweep(items, timepoint):
+    """
+    Memoized model predictions for Pre-Op Pain 0-10, keyed by the patient's sorted
+    (feature, value) pairs without Pre-Op Pain, since the sweep overrides it.
+    Entry i is the prediction with Pre-Op Pain set to i.
+    """
+    patient_data = dict(items)
+    sweep_rows = [{**patient_data, 'Pre-Op Pain': p} for p in range(11)]
+    return predict_with_model_batch(sweep_rows, timepoint).tolist()
+
+def predict_with_model_batch(patient_rows, timepoint='T3'):
+    """
+    Predict pain scores for several patients with a single preprocessor/model call.
     
-    # Determine required features
-    required_features = T3_IMPORTANT_FEATURES if timepoint == 'T3' else T5_IMPORTANT_FEATURES
+    Parameters:
+    -----------
+    patient_rows : list of dict
+        Dictionaries containing patient features, one per patient
+    timepoint : str, optional (default='T3')
+        Timepoint for which to predict pain ('T3' or 'T5')
+    
+    Returns:
+    --------
+    numpy.ndarray
+        Predicted pain scores, in the same order as patient_rows
+    """
+    # Clip predictions to valid range [0, 8]
+    return np.clip(_predict_unclipped(patient_rows, timepoint), 0, 8)
+
+def _predict_unclipped(patient_rows, timepoint):
+    """Run the preprocessor and model on patient_rows and return the raw predictions"""
+    # Normalize the timepoint and determine required features in one lookup
+    try:
+        timepoint, required_features, required = _DISPATCH[timepoint]
+    except KeyError:
+        raise ValueError("Timepoint must be 'T3' or 'T5'") from None
     
     # Check that all required features are provided
-    missing_features = [f for f in required_features if f not in patient_data]
-    if missing_features:
-        raise ValueError(f"Missing required features: {missing_features}")
+    for patient_data in patient_rows:
+        if not patient_data.keys() >= required:
+            missing_features = [f for f in required_features if f not in patient_data]
+            raise ValueError(f"Missing required features: {missing_features}")
     
-    # Create DataFrame from patient data
-    patient_df = pd.DataFrame([patient_data])
+    # Use the exported ONNX pipeline when there is one; it takes the raw features
+    # as a float tensor in the fitted column order
+    failed_onnx = _failed_onnx_timepoints()
+    session = None if timepoint in failed_onnx else _load_onnx_session(timepoint)
+    if session is not None:
+        input_arr = np.array(
+            [[row[f] for f in required_features] for row in patient_rows],
+            dtype=np.float32
+        )
+        try:
+            return session.run(None, {'input': input_arr})[0].ravel()
+        except Exception:
+            # Fall through to the joblib models rather than failing the prediction,
+            # and stop using this session so the failure isn't repeated on every click
+            logger.exception("ONNX prediction failed for %s; using the joblib models from now on", timepoint)
+            failed_onnx.add(timepoint)
     
-    # Convert HeadSize to string if present
-    if 'HeadSize' in patient_df.columns:
-        patient_df['HeadSize'] = patient_df['HeadSize'].astype(str)
+    # Load model and preprocessor
+    model, preprocessor = load_models(timepoint)
     
-    # Preprocess the patient data
-    patient_processed = preprocessor.transform(patient_df)
+    # Imported here so demo-mode sessions never pay for it
+    import pandas as pd
     
-    # Make prediction
-    prediction = model.predict(patient_processed)[0]
+    # Fill a record array laid out with the preprocessor's column order and dtypes, so
+    # pandas takes the schema as given instead of inferring every column's dtype.
+    # Categorical (object) columns, such as HeadSize, are converted to string here.
+    records = np.empty(len(patient_rows), dtype=_input_dtype(timepoint, preprocessor))
+    for f in records.dtype.names:
+        if records.dtype[f] == object:
+            records[f] = [str(row[f]) for row in patient_rows]
+        else:
+            records[f] = [row[f] for row in patient_rows]
+    patient_df = pd.DataFrame.from_records(records)
     
-    # Clip prediction to valid range [0, 8]
-    prediction = np.clip(prediction, 0, 8)
+    # Preprocess the patient data
+    patient_processed = preprocessor.transform(patient_df)
     
-    return prediction
+    # Make predictions
+    return model.predict(patient_processed)
 
 def predict_in_demo_mode(patient_data, timepoint):
     """Generate a simulated prediction for demo mode"""
-    # Simple simulation logic based on input values
+    # Simple linear formula based on input values
     if timepoint == "T3":
-        # Create a simple formula for demonstration
-        bmi_factor = 0.01 * patient_data.get('BMI_Current', 25)
-        age_factor = 0.01 * patient_data.get('AgePreOp', 65)
-        preop_factor = 0.2 * patient_data.get('Pre-Op Pain', 5)
-        walk_factor = 0.1 * patient_data.get('WalkPain', 5)
-        
-        prediction = 2.0 + bmi_factor + age_factor + preop_factor - walk_factor
-        prediction = max(0, min(8, prediction))  # Ensure between 0-8
+        keys, coef, bias = _T3_DEMO_KEYS, _T3_DEMO_COEF, _T3_DEMO_BIAS
     else:
-        # Different formula for T5
-        bmi_factor = 0.008 * patient_data.get('BMI_Current', 25)
-        age_factor = 0.005 * patient_data.get('AgePreOp', 65)
-        preop_factor = 0.15 * patient_data.get('Pre-Op Pain', 5)
-        approach_factor = 0.5 if patient_data.get('Approach') == 'Posterior' else 0
-        
-        prediction = 1.5 + bmi_factor + age_factor + preop_factor - approach_factor
-        prediction = max(0, min(8, prediction))  # Ensure between 0-8
+        # Different formula for T5, with the categorical Approach folded into the bias
+        keys, coef, bias = _T5_DEMO_KEYS, _T5_DEMO_COEF, _T5_DEMO_BIAS
+        if patient_data.get('Approach') == 'Posterior':
+            bias -= 0.5
     
-    return prediction
+    vals = np.fromiter(
+        (patient_data.get(k, _DEMO_DEFAULTS[k]) for k in keys),
+        dtype=np.float64,
+        count=len(keys)
+    )
+    return float(np.clip(bias + coef @ vals, 0, 8))  # Ensure between 0-8
 
+@st.cache_data(ttl=60)
 def check_models_exist():
     """Check if pre-trained models exist"""
-    model_files = [
-        os.path.join(MODELS_DIR, 't3_model.joblib'),
-        os.path.join(MODELS_DIR, 't3_preprocessor.joblib'),
-        os.path.join(MODELS_DIR, 't5_model.joblib'),
-        os.path.join(MODELS_DIR, 't5_preprocessor.joblib')
-    ]
-    
-    return all(os.path.exists(f) for f in model_files)
+    return all(
+        os.path.exists(_PIPELINE_PATHS[tp]) or all(os.path.exists(f) for f in paths)
+        for tp, paths in _MODEL_PATHS.items()
+    )
+
+# Preload both timepoints so the first Predict click doesn't pay the unpickling cost.
+# Streamlit re-executes this module on every rerun; the st.cache_resource functions
+# make that a no-op after the first run, including when loading failed (the error is
+# kept and reported on Predict, which falls back to demo mode).
+if check_models_exist():
+    for _timepoint in ('T3', 'T5'):
+        _load_models_once(_timepoint)
+        _load_onnx_session(_timepoint)
+
+def render_gauge(prediction):
+    """Return an inline SVG gauge showing the prediction on the 0-8 pain scale"""
+    bar_width = prediction * _GAUGE_SCALE
+    return _GAUGE_SVG.format(
+        bar_width=bar_width,
+        marker_x=_GAUGE_X0 + bar_width,
+        color=_GAUGE_COLORS[int(round(prediction * 10))],
+        value=f'{prediction:.1f}'
+    )
 
 def main():
     st.title("Hip Replacement Pain Predictor")
@@ -188,84 +471,42 @@ def main():
     st.header(f"Patient Information for {timepoint}")
     
     # Get required features based on timepoint
-    required_features = T3_IMPORTANT_FEATURES if timepoint_code == "T3" else T5_IMPORTANT_FEATURES
-    feature_descriptions = get_feature_descriptions()
-    
-    # Use columns to organize the layout
-    col1, col2 = st.columns(2)
+    required_features = IMPORTANT_FEATURES[timepoint_code]
     
-    # Initialize patient data dictionary
-    patient_data = {}
-    
-    # Create input fields for required features
-    for i, feature in enumerate(required_features):
-        description = feature_descriptions.get(feature, "")
+    # Collect the inputs in a form so Streamlit reruns once on submit,
+    # not once for every widget change
+    with st.form("patient_form"):
+        # Use columns to organize the layout
+        col1, col2 = st.columns(2)
         
-        # Decide which column to put the feature in (alternate between columns)
-        current_col = col1 if i % 2 == 0 else col2
+        # Initialize patient data dictionary
+        patient_data = {}
         
-        with current_col:
-            if feature == 'MobilityAidWalker':
-                patient_data[feature] = int(st.selectbox(
-                    f"{feature} ({description})",
-                    options=[0, 1],
-                    format_func=lambda x: "No" if x == 0 else "Yes"
-                ))
-            elif feature == 'Approach':
-                patient_data[feature] = st.selectbox(
-                    f"{feature} ({description})",
-                    options=["Posterior", "Anterior", "Lateral", "Other"]
-                )
-            elif feature in ['WOMACP_5', 'WOMACP_3', 'ICOAPC_3', 'ICOAPC_1']:
-                # WOMAC and ICOA scores are on 0-4 scale
-                patient_data[feature] = st.slider(
-                    f"{feature} ({description})",
-                    min_value=0,
-                    max_value=4,
-                    step=1
-                )
-            elif feature == 'ResultsRelief':
-                # ResultsRelief is on 1-5 scale
-                patient_data[feature] = st.slider(
-                    f"{feature} ({description})",
-                    min_value=1,
-                    max_value=5,
-                    step=1
-                )
-            elif feature == 'WalkPain' or feature == 'Pre-Op Pain':
-                # Pain scores are on 0-10 scale
-                patient_data[feature] = st.slider(
-                    f"{feature} ({description})",
-                    min_value=0,
-                    max_value=10,
-                    step=1
-                )
-            elif feature == 'HeadSize':
-                # HeadSize is typically 28, 32, or 36 mm
-                patient_data[feature] = st.selectbox(
-                    f"{feature} ({description})",
-                    options=["28", "32", "36", "40", "Other"]
-                )
-            else:
-                # Default numeric input for other fields
-                patient_data[feature] = st.number_input(
-                    f"{feature} ({description})",
-                    value=0.0,
-                    step=0.1
-                )
-    
-    # Predict button
-    if st.button("Predict Pain Score"):
+        # Create input fields for required features
+        for i, feature in enumerate(required_features):
+            # Decide which column to put the feature in (alternate between columns)
+            current_col = col1 if i % 2 == 0 else col2
+            
+            with current_col:
+                kind, kwargs = WIDGET_SPECS.get(feature, DEFAULT_WIDGET_SPEC)
+                patient_data[feature] = getattr(st, kind)(_LABELS[feature], key=feature, **kwargs)
+        
+        # Predict button
+        submitted = st.form_submit_button("Predict Pain Score")
+    
+    if submitted:
         try:
             # Try to use the trained model first, fall back to demo mode if it fails
+            use_model = not use_demo_mode
             if use_demo_mode:
                 prediction = predict_in_demo_mode(patient_data, timepoint_code)
                 st.info("Using demo mode: predictions are approximate and not based on trained models")
             else:
                 try:
-                    prediction = predict_with_model(patient_data, timepoint_code)
+                    prediction = _cached_predict(tuple(sorted(patient_data.items())), timepoint_code)
                 except Exception as e:
                     st.warning(f"Error using trained model: {str(e)}. Falling back to demo mode.")
+                    use_model = False
                     prediction = predict_in_demo_mode(patient_data, timepoint_code)
                     st.info("Using demo mode: predictions are approximate and not based on trained models")
             
@@ -273,34 +514,7 @@ def main():
             st.header("Prediction Results")
             
             # Create a gauge-chart-like display
-            fig, ax = plt.subplots(figsize=(10, 2))
-            
-            # Create a color gradient for the gauge
-            cmap = plt.cm.RdYlGn_r  # Red-Yellow-Green reversed (red is high pain)
-            
-            # Background bar (grey)
-            ax.barh(0, 8, color='lightgrey', alpha=0.3)
-            
-            # Colored bar based on prediction
-            ax.barh(0, prediction, color=cmap(prediction/8))
-            
-            # Customize appearance
-            ax.set_xlim(0, 8)
-            ax.set_yticks([])
-            ax.set_xticks([0, 2, 4, 6, 8])
-            ax.set_xticklabels(['0\nNo Pain', '2', '4', '6', '8\nExtreme Pain'])
-            
-            # Add marker for the prediction
-            ax.plot(prediction, 0, 'ko', markersize=12)
-            ax.text(prediction, 0, f'{prediction:.1f}', ha='center', va='bottom', fontsize=14, fontweight='bold')
-            
-            # Remove y-axis
-            ax.spines['left'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['top'].set_visible(False)
-            
-            # Display the plot
-            st.pyplot(fig)
+            st.markdown(render_gauge(prediction), unsafe_allow_html=True)
             
             # Interpret the prediction
             if prediction <= 2:
@@ -323,6 +537,22 @@ def main():
             This prediction suggests a **{interpretation}** pain level ({prediction:.1f}/8) at {timepoint}.
             """)
             
+            # Show how the prediction changes across the whole Pre-Op Pain scale,
+            # scoring every point in one cached batch rather than one call per point
+            with st.expander("Sensitivity analysis: Pre-Op Pain"):
+                if use_model:
+                    sweep_items = tuple(sorted(
+                        (k, v) for k, v in patient_data.items() if k != 'Pre-Op Pain'
+                    ))
+                    sweep = _cached_pre_op_pain_sweep(sweep_items, timepoint_code)
+                else:
+                    sweep = [
+                        predict_in_demo_mode({**patient_data, 'Pre-Op Pain': p}, timepoint_code)
+                        for p in range(11)
+                    ]
+                st.line_chart({'Predicted pain score': sweep})
+                st.caption("Predicted pain score (0-8) for each Pre-Op Pain score (0-10), other inputs unchanged")
+            
         except Exception as e:
             st.error(f"Error making prediction: {str(e)}")
 
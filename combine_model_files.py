@@ -0,0 +1,26 @@
+"""
+Combine each timepoint's model and preprocessor into a single joblib file
+
+The web app loads <timepoint>_pipeline.joblib, a (preprocessor, model) tuple,
+in one joblib.load call when it exists, instead of the two separate files.
+The file is written uncompressed so the app can memory-map it.
+
+Run with: python combine_model_files.py
+"""
+import os
+import joblib
+
+MODELS_DIR = 'streamlit_models'
+
+def combine_model_files(timepoint):
+    """Save the preprocessor and model for a timepoint as one (preprocessor, model) tuple"""
+    model = joblib.load(os.path.join(MODELS_DIR, f'{timepoint.lower()}_model.joblib'))
+    preprocessor = joblib.load(os.path.join(MODELS_DIR, f'{timepoint.lower()}_preprocessor.joblib'))
+    
+    pipeline_path = os.path.join(MODELS_DIR, f'{timepoint.lower()}_pipeline.joblib')
+    joblib.dump((preprocessor, model), pipeline_path)
+    print(f"Saved {timepoint} pipeline to {pipeline_path}")
+
+if __name__ == "__main__":
+    for timepoint in ('T3', 'T5'):
+        combine_model_files(timepoint)
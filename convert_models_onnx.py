@@ -0,0 +1,92 @@
+"""
+Export the trained pain models to ONNX for faster single-row predictions
+
+Requires skl2onnx and onnxruntime (pip install skl2onnx onnxruntime).
+The web app picks up the exported files automatically when onnxruntime is installed.
+
+Run with: python convert_models_onnx.py
+"""
+import os
+import joblib
+import numpy as np
+import pandas as pd
+import onnxruntime as ort
+from sklearn.pipeline import Pipeline
+from skl2onnx import convert_sklearn
+from skl2onnx.common.data_types import FloatTensorType
+
+MODELS_DIR = 'streamlit_models'
+
+# Largest allowed difference between the ONNX and sklearn predictions. The ONNX
+# pipeline scales inputs in float32, which can send a value near a tree threshold
+# down the other branch.
+MAX_PREDICTION_DIFF = 1e-3
+N_CHECK_SAMPLES = 1000
+
+def get_numeric_transformer(preprocessor):
+    """
+    Return the transformer inside a ColumnTransformer that applies to every input
+    column in order, or None if the preprocessor does anything else.
+    
+    Only preprocessors like this can take a single float tensor as input.
+    """
+    transformers = [t for t in preprocessor.transformers_ if t[0] != 'remainder']
+    if len(transformers) != 1:
+        return None
+    
+    _, transformer, columns = transformers[0]
+    if list(columns) != list(preprocessor.feature_names_in_):
+        return None
+    
+    return transformer
+
+def sample_inputs(transformer, n_samples):
+    """
+    Draw random inputs spread like the training data, using the fitted scaler's
+    mean and scale for each feature.
+    """
+    steps = [step for _, step in transformer.steps] if hasattr(transformer, 'steps') else [transformer]
+    scaler = next(step for step in steps if hasattr(step, 'mean_') and hasattr(step, 'scale_'))
+    rng = np.random.default_rng(0)
+    samples = scaler.mean_ + scaler.scale_ * rng.standard_normal((n_samples, len(scaler.mean_)))
+    return samples.astype(np.float32)
+
+def max_prediction_diff(onnx_model, model, preprocessor, inputs):
+    """Return the largest difference between ONNX and sklearn predictions on inputs"""
+    session = ort.InferenceSession(onnx_model.SerializeToString(), providers=['CPUExecutionProvider'])
+    onnx_pred = session.run(None, {'input': inputs})[0].ravel()
+    
+    inputs_df = pd.DataFrame(inputs.astype(np.float64), columns=preprocessor.feature_names_in_)
+    sklearn_pred = model.predict(preprocessor.transform(inputs_df))
+    
+    return float(np.max(np.abs(onnx_pred - sklearn_pred)))
+
+def convert_model(timepoint):
+    """Export the preprocessor and model for a timepoint as a single ONNX pipeline"""
+    model = joblib.load(os.path.join(MODELS_DIR, f'{timepoint.lower()}_model.joblib'))
+    preprocessor = joblib.load(os.path.join(MODELS_DIR, f'{timepoint.lower()}_preprocessor.joblib'))
+    
+    transformer = get_numeric_transformer(preprocessor)
+    if transformer is None:
+        print(f"Skipping {timepoint}: its preprocessor has categorical columns, "
+              f"which can't be passed in a single float input")
+        return
+    
+    pipeline = Pipeline([('preprocessor', transformer), ('model', model)])
+    n_features = preprocessor.n_features_in_
+    onnx_model = convert_sklearn(pipeline, initial_types=[('input', FloatTensorType([None, n_features]))])
+    
+    # Only save the ONNX pipeline if it reproduces the sklearn predictions
+    diff = max_prediction_diff(onnx_model, model, preprocessor, sample_inputs(transformer, N_CHECK_SAMPLES))
+    if diff > MAX_PREDICTION_DIFF:
+        print(f"Skipping {timepoint}: ONNX predictions differ from sklearn by up to {diff:.4f}")
+        return
+    
+    onnx_path = os.path.join(MODELS_DIR, f'{timepoint.lower()}_pipeline.onnx')
+    with open(onnx_path, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+    print(f"Saved {timepoint} pipeline to {onnx_path}")
+
+if __name__ == "__main__":
+    for timepoint in ('T3', 'T5'):
+        convert_model(timepoint)